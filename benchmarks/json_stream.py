@@ -0,0 +1,154 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+COMPARE mo_json.stream TO THE PARSER IT REPLACED, ON A GENERATED FILE
+
+    PYTHONPATH=.:vendor python benchmarks/json_stream.py generate big.json 1024
+    PYTHONPATH=.:vendor python benchmarks/json_stream.py generate lines.json 1024 --lines
+    PYTHONPATH=.:vendor python benchmarks/json_stream.py time big.json --baseline <revision>
+    PYTHONPATH=.:vendor python benchmarks/json_stream.py time lines.json --lines --baseline old_stream.py
+
+--baseline IS THE OLD mo_json/stream.py: EITHER A FILE, OR A git REVISION TO
+READ vendor/mo_json/stream.py FROM (SO THAT MUST RUN IN A CLONE)
+"""
+from __future__ import division
+from __future__ import unicode_literals
+
+import argparse
+import json
+import mmap
+import os
+import random
+import subprocess
+import sys
+import types
+from time import time
+
+from mo_dots import unwrap
+from mo_json import stream
+
+TESTS = {
+    # NAME: (query_path, expected_vars)
+    "array": ("data", ["data.id", "data.name", "meta.version"]),
+    "skip": ("tail.x", ["tail.x"]),
+}
+
+
+def generate(filename, megabytes, lines=False):
+    """
+    WRITE {"meta": ..., "data": [rows], "tail": ...}, OR ONE ROW PER LINE
+    :return: NUMBER OF ROWS
+    """
+    r = random.Random(42)
+    target = megabytes * 1024 * 1024
+    with open(filename, "wb") as f:
+        size = 0
+        if not lines:
+            head = b'{"meta": {"version": 3, "name": "benchmark"}, "data": ['
+            f.write(head)
+            size += len(head)
+        i = 0
+        while size < target:
+            row = {
+                "id": i,
+                "name": "task-%d \"quoted\" \\ é" % i,
+                "tags": ["t%d" % r.randint(0, 50) for _ in range(5)],
+                "nested": {"a": [1, 2, {"b": [3, 4]}], "c": None, "d": True, "e": 1.5e3},
+                "text": "x" * r.randint(10, 300),
+            }
+            data = json.dumps(row).encode("utf8")
+            if lines:
+                data += b"\n"
+            elif i:
+                data = b", " + data
+            f.write(data)
+            size += len(data)
+            i += 1
+        if not lines:
+            # A CLOSING BRACKET IN A STRING, AFTER THE BIG ARRAY
+            f.write(b'], "tail": {"x": [1, {"y": "]"}]}}')
+    return i
+
+
+def load_baseline(baseline):
+    if os.path.isfile(baseline):
+        with open(baseline, "rb") as f:
+            source = f.read()
+    else:
+        source = subprocess.check_output(
+            ["git", "show", baseline + ":vendor/mo_json/stream.py"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    module = types.ModuleType("baseline_stream")
+    module.__file__ = baseline
+    exec(compile(source, module.__file__, "exec"), module.__dict__)
+    return module
+
+
+def run(module, filename, test, use_mmap):
+    """
+    :return: (SECONDS, LAST ROW, NUMBER OF ROWS)
+    """
+    start = time()
+    num = 0
+    row = None
+    with open(filename, "rb") as f:
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap else f
+        if test == "lines":
+            rows = module.parse_concatenated(source, ".", ["id", "name"])
+        else:
+            query_path, expected_vars = TESTS[test]
+            rows = module.parse(source, query_path, expected_vars)
+        for row in rows:
+            num += 1
+    return time() - start, unwrap(row), num
+
+
+def time_parsers(filename, lines, baseline, use_mmap):
+    old = load_baseline(baseline)
+    megabytes = os.path.getsize(filename) / 1024 / 1024
+    mismatches = 0
+    for test in ["lines"] if lines else sorted(TESTS):
+        print("%s, %.0f MB" % (test, megabytes))
+        results = []
+        for name, module in [("old", old), ("new", stream)]:
+            duration, row, num = run(module, filename, test, use_mmap and name == "new")
+            print("    %s  %8d rows  %6.1f sec  %6.1f MB/sec" % (name, num, duration, megabytes / duration))
+            results.append((row, num))
+        if results[0] != results[1]:
+            mismatches += 1
+            print("    DIFFERENT RESULTS: %s" % results)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+    gen = commands.add_parser("generate")
+    gen.add_argument("filename")
+    gen.add_argument("megabytes", type=int, nargs="?", default=1024)
+    gen.add_argument("--lines", action="store_true", help="ONE JSON DOCUMENT PER LINE")
+    timer = commands.add_parser("time")
+    timer.add_argument("filename")
+    timer.add_argument("--lines", action="store_true", help="ONE JSON DOCUMENT PER LINE")
+    timer.add_argument("--baseline", required=True, help="FILE, OR git REVISION, OF THE OLD PARSER")
+    timer.add_argument("--mmap", action="store_true", help="GIVE THE NEW PARSER AN mmap")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        print("%d rows" % generate(args.filename, args.megabytes, args.lines))
+        return 0
+    elif args.command == "time":
+        return 1 if time_parsers(args.filename, args.lines, args.baseline, args.mmap) else 0
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+COMPARE jx.sort() AND groupby(ordered=False) TO THE value_compare() VERSIONS
+
+    PYTHONPATH=.:vendor python benchmarks/jx_sort.py [num_rows]
+"""
+from __future__ import division
+from __future__ import unicode_literals
+
+import random
+import sys
+from time import time
+
+from jx_base.language import value_compare
+from jx_python import jx
+from jx_python.group_by import groupby
+from mo_dots import unwrap
+from mo_future import sort_using_cmp
+
+FIELDS = [{"value": "branch", "sort": 1}, {"value": "push", "sort": -1}]
+
+
+def compare_sort(rows, fields):
+    """
+    jx.sort() AS IT WAS, WITH value_compare() ON EVERY PAIR
+    """
+    funcs = [(f["value"], f["sort"]) for f in fields]
+
+    def comparer(left, right):
+        for field, sort_ in funcs:
+            result = value_compare(left.get(field), right.get(field), sort_)
+            if result != 0:
+                return result
+        return 0
+
+    return sort_using_cmp(rows, cmp=comparer)
+
+
+def timed(name, func, *args):
+    start = time()
+    result = func(*args)
+    duration = time() - start
+    print("    %-28s %6.1f sec" % (name, duration))
+    return result
+
+
+def main(num_rows):
+    r = random.Random(42)
+    rows = [
+        {
+            "branch": r.choice(["autoland", "try", "mozilla-central", None]),
+            "push": r.choice([r.randint(1, 10 ** 6), r.random() * 10 ** 6, None]),
+        }
+        for _ in range(num_rows)
+    ]
+    strings = ["%x" % r.getrandbits(64) for _ in range(num_rows)]
+
+    mismatches = 0
+    print("two-field sort, mixed directions, %d rows" % num_rows)
+    expected = timed("value_compare()", compare_sort, rows, FIELDS)
+    result = timed("value_key()", jx.sort, rows, FIELDS)
+    mismatches += any(a is not b for a, b in zip(expected, unwrap(result)))
+
+    print("sort %d strings" % num_rows)
+    expected = timed("value_compare()", sort_using_cmp, strings, value_compare)
+    result = timed("value_key()", jx.sort, strings)
+    mismatches += list(expected) != list(result)
+
+    print("groupby branch, %d rows" % num_rows)
+    expected = timed("sort, then scan", lambda: list(groupby(rows, "branch")))
+    result = timed("hash", groupby, rows, "branch", False, False)
+    mismatches += sorted(len(g) for _, g in expected) != sorted(len(g) for _, g in result)
+
+    print("mismatches: %d" % mismatches)
+    return mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000) else 0)
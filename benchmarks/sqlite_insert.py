@@ -0,0 +1,140 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+COMPARE InsertTable._insert() (execute_many) TO THE ORIGINAL MULTI-ROW INSERT
+
+    PYTHONPATH=.:vendor python benchmarks/sqlite_insert.py [num_docs]
+
+THE SAME DOCUMENTS ARE INSERTED INTO A FRESH DATABASE WITH EACH VERSION; THE
+TABLES MUST HOLD THE SAME ROWS (IGNORING THE RANDOM _id)
+"""
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import random
+import sys
+import tempfile
+from time import time
+
+import jx_sqlite
+from jx_sqlite import sqlite
+from jx_sqlite.insert_table import InsertTable
+from jx_sqlite.sqlite import quote_column, quote_value
+from jx_sqlite.utils import GUID, ORDER, PARENT, UID
+from mo_dots import concat_field, unwrap, wrap
+from mo_sql import ConcatSQL, SQL_INSERT, SQL_VALUES, sql_iso, sql_list
+
+sqlite.DEBUG = False
+
+
+def old_insert(self, collection):
+    """
+    InsertTable._insert() AS IT WAS BEFORE execute_many()
+    """
+    for nested_path, details in collection.items():
+        active_columns = wrap(list(details.active_columns))
+        rows = details.rows
+        table_name = concat_field(self.name, nested_path)
+
+        if table_name == self.name:
+            meta_columns = [GUID, UID]
+        else:
+            meta_columns = [UID, PARENT, ORDER]
+
+        all_columns = meta_columns + active_columns.es_column
+        command = ConcatSQL(
+            SQL_INSERT,
+            quote_column(table_name),
+            sql_iso(sql_list(map(quote_column, all_columns))),
+            SQL_VALUES,
+            sql_list(
+                sql_iso(sql_list(quote_value(row.get(c)) for c in all_columns))
+                for row in unwrap(rows)
+            ),
+        )
+
+        with self.db.transaction() as t:
+            t.execute(command)
+
+
+def flat_doc(r):
+    return {
+        "push": r.randint(1, 10 ** 6),
+        "branch": r.choice(["autoland", "try"]),
+        "state": r.choice(["pending", "done", "failed"]),
+        "attempts": r.randint(0, 3),
+        "duration": r.random() * 100,
+    }
+
+
+def nested_doc(r):
+    doc = flat_doc(r)
+    doc["tasks"] = [
+        {"label": r.choice(["build", "mochitest", "xpcshell"]), "duration": r.random()}
+        for _ in range(r.randint(1, 4))
+    ]
+    return doc
+
+
+def run(insert, docs, filename):
+    """
+    :return: (SECONDS SPENT IN _insert(), ROWS OF EVERY TABLE)
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    container = jx_sqlite.Container({"filename": filename})
+    facts = container.get_or_create_facts("benchmark")
+
+    timing = []
+
+    def timed_insert(self, collection):
+        start = time()
+        insert(self, collection)
+        timing.append(time() - start)
+
+    original, InsertTable._insert = InsertTable._insert, timed_insert
+    try:
+        facts.insert(docs)
+    finally:
+        InsertTable._insert = original
+
+    tables = {}
+    for (name,) in container.db.query(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'benchmark%'"
+    ).data:
+        result = container.db.query("SELECT * FROM " + quote_column(name).sql)
+        keep = [i for i, h in enumerate(result.header) if h != GUID]
+        tables[name] = sorted(
+            tuple(row[i] for i in keep) for row in result.data
+        )
+    container.db.close()
+    return sum(timing), tables
+
+
+def main(num_docs):
+    tempdir = tempfile.mkdtemp()
+    mismatches = 0
+    for kind, make in [("flat", flat_doc), ("nested", nested_doc)]:
+        r = random.Random(42)
+        docs = [make(r) for _ in range(num_docs)]
+        old_duration, old_tables = run(old_insert, docs, os.path.join(tempdir, "old.sqlite"))
+        new_duration, new_tables = run(InsertTable._insert, docs, os.path.join(tempdir, "new.sqlite"))
+        if old_tables != new_tables:
+            mismatches += 1
+        print("%s documents: %d" % (kind, num_docs))
+        print("    multi-row INSERT:  %.0f docs/sec" % (num_docs / old_duration))
+        print("    execute_many:      %.0f docs/sec" % (num_docs / new_duration))
+        print("    speedup:           %.1fx" % (old_duration / new_duration))
+        print("    same rows:         %s" % (old_tables == new_tables))
+    return mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000) else 0)
@@ -0,0 +1,158 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+COMPARE THE COMPILED ENCODER (typed_encode) TO THE ORIGINAL _typed_encode PATH
+
+    PYTHONPATH=.:vendor python benchmarks/typed_encoder.py [num_rows]
+
+EVERY RECORD IS ENCODED BOTH WAYS, WITH TWO SNOWFLAKES THAT START WITH THE
+SAME SCHEMA; THE OUTPUT, THE SCHEMA UPDATES, AND THE FINAL SCHEMAS MUST MATCH
+"""
+from __future__ import division
+from __future__ import unicode_literals
+
+import json
+import random
+import sys
+from time import time
+
+from jx_bigquery import typed_encoder
+from jx_bigquery.snowflakes import Snowflake
+from jx_bigquery.typed_encoder import typed_encode
+from jx_python import jx
+from mo_dots import join_field, split_field, wrap
+
+TOP_LEVEL_FIELDS = {
+    "push": {"id": "_push_id", "date": "_push_date"},
+    "etl": {"timestamp": "_etl_timestamp"},
+}
+PARTITION = {"field": "push.date", "expire": "2year"}
+SCHEMA = {
+    "_id": {"_i_": "integer"},
+    "push": {"id": {"_i_": "integer"}, "date": {"_t_": "time"}},
+    "etl": {"timestamp": {"_t_": "time"}},
+}
+
+
+def old_typed_encode(value, flake):
+    """
+    typed_encode() AS IT WAS BEFORE THE COMPILED ENCODER
+    """
+    _ = flake.columns
+    output, update, nested = typed_encoder._typed_encode(value, flake.schema)
+    if update or nested:
+        flake._columns = None
+        flake._encoder = None
+        _ = flake.columns
+
+    worker = wrap(output)
+    for path, field in flake._top_level_fields.items():
+        worker[field] = worker[path]
+        worker[path] = None
+
+        _path = split_field(path)
+        for i, _ in jx.reverse(enumerate(_path)):
+            sub_path = join_field(_path[:i])
+            if not worker[sub_path].keys():
+                worker[sub_path] = None
+            else:
+                break
+
+    return output, update, nested
+
+
+def make_flake():
+    return Snowflake(
+        "benchmark",
+        wrap(TOP_LEVEL_FIELDS),
+        wrap(PARTITION),
+        schema=json.loads(json.dumps(SCHEMA)),
+    )
+
+
+def make_record(i):
+    """
+    SHAPED LIKE THE mo_etl.schedulers RECORDS, WITH THE OCCASIONAL NEW PROPERTY,
+    AND A PROPERTY THAT IS NEVER MORE THAN null, SO ITS SCHEMA STAYS EMPTY
+    """
+    r = random.Random(i)
+    record = {
+        "push": {
+            "id": r.randint(1, 10 ** 6),
+            "date": 1600000000 + r.random() * 1000,
+            "changesets": ["%040x" % r.getrandbits(160) for _ in range(r.randint(1, 3))],
+            "backedoutby": None if r.random() < 0.9 else "%040x" % r.getrandbits(160),
+        },
+        "schedulers": [
+            {
+                "name": r.choice(["bugbug", "relevance", "fixed"]),
+                "tasks": [r.choice(["build", "mochitest", "xpcshell"]) for _ in range(r.randint(0, 5))],
+            }
+            for _ in range(r.randint(0, 3))
+        ],
+        "regressions": [{"label": r.choice(["a", "b", "c"])} for _ in range(r.randint(0, 2))],
+        "branch": r.choice(["autoland", "try"]),
+        "etl": {"revision": None if r.random() < 0.2 else "abc", "timestamp": 1600000000.5},
+        "error": r.choice([None, None, None, [], {}]),
+    }
+    if r.random() < 0.01:
+        record["extra"] = r.choice([1, "x", True, None, [1, 2]])
+    return record
+
+
+def run(encode, rows, flake):
+    """
+    :return: (OUTPUT, SECONDS, NUMBER OF _typed_encode() CALLS)
+    """
+    calls = [0]
+
+    def counting(value, schema):
+        calls[0] += 1
+        return slow(value, schema)
+
+    output = []
+    slow, typed_encoder._typed_encode = typed_encoder._typed_encode, counting
+    try:
+        start = time()
+        for row in rows:
+            output.append(encode(row, flake))
+        duration = time() - start
+    finally:
+        typed_encoder._typed_encode = slow
+    return output, duration, calls[0]
+
+
+def main(num_rows):
+    rows = [make_record(i) for i in range(num_rows)]
+    old_flake, new_flake = make_flake(), make_flake()
+    old, old_duration, _ = run(old_typed_encode, rows, old_flake)
+    new, new_duration, slow_calls = run(typed_encode, rows, new_flake)
+
+    mismatches = 0
+    for (a, a_update, a_nested), (b, b_update, b_nested) in zip(old, new):
+        if (
+            json.dumps(a, sort_keys=True) != json.dumps(b, sort_keys=True)
+            or bool(a_update) != bool(b_update)
+            or a_nested != b_nested
+        ):
+            mismatches += 1
+    if old_flake.schema != new_flake.schema:
+        mismatches += 1
+
+    print("rows:               %d" % num_rows)
+    print("_typed_encode:      %.0f rows/sec" % (num_rows / old_duration))
+    print("compiled encoder:   %.0f rows/sec" % (num_rows / new_duration))
+    print("speedup:            %.1fx" % (old_duration / new_duration))
+    print("slow path calls:    %d" % slow_calls)
+    print("mismatches:         %d" % mismatches)
+    return mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000) else 0)
@@ -0,0 +1,353 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+import threading
+from time import time
+
+from cachy.contracts.store import Store
+
+from jx_sqlite.sqlite import Sqlite, quote_column, quote_value
+from mo_kwargs import override
+from mo_logs import Log
+from mo_sql import (
+    ConcatSQL,
+    SQL,
+    SQL_AND,
+    SQL_DELETE,
+    SQL_EQ,
+    SQL_FROM,
+    SQL_IN,
+    SQL_IS_NOT_NULL,
+    SQL_LT,
+    SQL_ORDERBY,
+    SQL_SELECT,
+    SQL_WHERE,
+    sql_iso,
+    sql_list,
+)
+from mo_threads import Lock
+
+DEBUG = False
+TABLE = "cache"
+DEFAULT_FILENAME = "cache.sqlite"
+MAX_SIZE = 1000 * 1000 * 1000  # BYTES OF SERIALIZED VALUES TO KEEP
+LOW_WATER = 0.9  # EVICT DOWN TO THIS FRACTION OF max_size
+TOUCH_BATCH = 100  # NUMBER OF HITS TO REMEMBER BEFORE WRITING THEIR ACCESS TIMES
+
+_context = threading.local()
+
+
+class settled(object):
+    """
+    WITH settled(True):
+        ANYTHING THIS THREAD PUTS IN THE CACHE IS KEPT UNTIL EVICTED, NOT
+        UNTIL IT EXPIRES, BECAUSE IT IS ABOUT DATA THAT WILL NOT CHANGE
+    """
+
+    __slots__ = ["value", "previous"]
+
+    def __init__(self, value=True):
+        self.value = value
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(_context, "settled", False)
+        _context.settled = self.value
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _context.settled = self.previous
+
+
+class CacheStore(Store):
+    """
+    cachy STORE IN A LOCAL SQLITE FILE, WITH LRU EVICTION AND HIT/MISS COUNTS
+    """
+
+    @override
+    def __init__(
+        self,
+        filename=DEFAULT_FILENAME,
+        max_size=MAX_SIZE,  # BYTES
+        readers=2,  # READ-ONLY CONNECTIONS, SO LOOKUPS DO NOT WAIT ON WRITES
+        prefix="",
+        kwargs=None,
+    ):
+        self.max_size = max_size
+        self.prefix = prefix
+        self.db = Sqlite(filename=filename, readers=readers)
+        with self.db.transaction() as t:
+            t.execute(
+                "CREATE TABLE IF NOT EXISTS "
+                + TABLE
+                + " (key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL, size INTEGER)"
+            )
+            t.execute(
+                "CREATE INDEX IF NOT EXISTS "
+                + TABLE
+                + "_accessed ON "
+                + TABLE
+                + " (accessed)"
+            )
+
+        self.lock = Lock("cache stats")
+        self.touched = {}  # MAP FROM KEY TO LAST ACCESS, NOT YET WRITTEN
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.size = self.db.query(
+            ConcatSQL(SQL_SELECT, SQL("COALESCE(SUM(size), 0)"), SQL_FROM, quote_column(TABLE))
+        ).data[0][0]
+
+    @property
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "puts": self.puts,
+                "evictions": self.evictions,
+                "size": self.size,
+            }
+
+    def get(self, key):
+        key = self.prefix + key
+        now = time()
+        rows = self.db.query(
+            ConcatSQL(
+                SQL_SELECT,
+                sql_list([quote_column("value"), quote_column("expires")]),
+                SQL_FROM,
+                quote_column(TABLE),
+                SQL_WHERE,
+                quote_column("key"),
+                SQL_EQ,
+                quote_value(key),
+            )
+        ).data
+        if rows:
+            value, expires = rows[0]
+            if expires is None or expires > now:
+                with self.lock:
+                    self.hits += 1
+                    self.touched[key] = now
+                    touched = self._pop_touched()
+                self._write_touched(touched)
+                return self.unserialize(value)
+            self._forget(key)
+
+        with self.lock:
+            self.misses += 1
+        DEBUG and Log.note("cache miss {{key|quote}}", key=key)
+        return None
+
+    def put(self, key, value, minutes):
+        key = self.prefix + key
+        now = time()
+        if not minutes or getattr(_context, "settled", False):
+            expires = None
+        else:
+            expires = now + minutes * 60
+        value = self.serialize(value)
+        size = len(value)
+
+        with self.db.transaction() as t:
+            previous = t.query(
+                ConcatSQL(
+                    SQL_SELECT,
+                    quote_column("size"),
+                    SQL_FROM,
+                    quote_column(TABLE),
+                    SQL_WHERE,
+                    quote_column("key"),
+                    SQL_EQ,
+                    quote_value(key),
+                )
+            ).data
+            t.execute_many(
+                "INSERT OR REPLACE INTO "
+                + TABLE
+                + " (key, value, expires, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                [(key, value, expires, now, size)],
+            )
+        with self.lock:
+            self.puts += 1
+            self.touched.pop(key, None)
+            self.size += size - (previous[0][0] if previous else 0)
+            full = self.size > self.max_size
+        if full:
+            self._evict()
+
+    def increment(self, key, value=1):
+        raw = self.get(key)
+        if raw is None:
+            return False
+        integer = int(raw) + value
+        expires = self.db.query(
+            ConcatSQL(
+                SQL_SELECT,
+                quote_column("expires"),
+                SQL_FROM,
+                quote_column(TABLE),
+                SQL_WHERE,
+                quote_column("key"),
+                SQL_EQ,
+                quote_value(self.prefix + key),
+            )
+        ).data
+        if expires and expires[0][0] is not None:
+            minutes = max(1, int((expires[0][0] - time()) / 60))
+        else:
+            minutes = 0
+        self.put(key, integer, minutes)
+        return integer
+
+    def decrement(self, key, value=1):
+        return self.increment(key, -value)
+
+    def forever(self, key, value):
+        self.put(key, value, 0)
+
+    def forget(self, key):
+        return self._forget(self.prefix + key)
+
+    def flush(self):
+        with self.db.transaction() as t:
+            t.execute(ConcatSQL(SQL_DELETE, SQL_FROM, quote_column(TABLE)))
+        with self.lock:
+            self.size = 0
+            self.touched = {}
+
+    def get_prefix(self):
+        return self.prefix
+
+    def close(self):
+        with self.lock:
+            touched = self._pop_touched(force=True)
+        self._write_touched(touched)
+        self.db.close()
+
+    def _forget(self, key):
+        with self.db.transaction() as t:
+            rows = t.query(
+                ConcatSQL(
+                    SQL_SELECT,
+                    quote_column("size"),
+                    SQL_FROM,
+                    quote_column(TABLE),
+                    SQL_WHERE,
+                    quote_column("key"),
+                    SQL_EQ,
+                    quote_value(key),
+                )
+            ).data
+            if not rows:
+                return False
+            t.execute(
+                ConcatSQL(
+                    SQL_DELETE,
+                    SQL_FROM,
+                    quote_column(TABLE),
+                    SQL_WHERE,
+                    quote_column("key"),
+                    SQL_EQ,
+                    quote_value(key),
+                )
+            )
+        with self.lock:
+            self.size -= rows[0][0]
+            self.touched.pop(key, None)
+        return True
+
+    def _pop_touched(self, force=False):
+        """
+        EXPECTING self.lock TO BE HELD
+        :return: ACCESS TIMES THAT SHOULD BE WRITTEN NOW
+        """
+        if not force and len(self.touched) < TOUCH_BATCH:
+            return {}
+        touched, self.touched = self.touched, {}
+        return touched
+
+    def _write_touched(self, touched):
+        if not touched:
+            return
+        with self.db.transaction() as t:
+            t.execute_many(
+                "UPDATE " + TABLE + " SET accessed=? WHERE key=?",
+                [(accessed, key) for key, accessed in touched.items()],
+            )
+
+    def _evict(self):
+        """
+        REMOVE EXPIRED ENTRIES, THEN LEAST RECENTLY USED, UNTIL UNDER LOW_WATER
+        """
+        with self.lock:
+            touched = self._pop_touched(force=True)
+        self._write_touched(touched)
+
+        now = time()
+        with self.db.transaction() as t:
+            t.execute(
+                ConcatSQL(
+                    SQL_DELETE,
+                    SQL_FROM,
+                    quote_column(TABLE),
+                    SQL_WHERE,
+                    quote_column("expires"),
+                    SQL_IS_NOT_NULL,
+                    SQL_AND,
+                    quote_column("expires"),
+                    SQL_LT,
+                    quote_value(now),
+                )
+            )
+            rows = t.query(
+                ConcatSQL(
+                    SQL_SELECT,
+                    sql_list([quote_column("key"), quote_column("size")]),
+                    SQL_FROM,
+                    quote_column(TABLE),
+                    SQL_ORDERBY,
+                    quote_column("accessed"),
+                )
+            ).data
+
+            # rows IS NOW EVERYTHING THAT IS LEFT, OLDEST ACCESS FIRST
+            size = sum(s for _, s in rows)
+            goal = self.max_size * LOW_WATER
+            evict = []
+            for key, s in rows:
+                if size <= goal:
+                    break
+                evict.append(key)
+                size -= s
+            for i in range(0, len(evict), TOUCH_BATCH):
+                t.execute(
+                    ConcatSQL(
+                        SQL_DELETE,
+                        SQL_FROM,
+                        quote_column(TABLE),
+                        SQL_WHERE,
+                        quote_column("key"),
+                        SQL_IN,
+                        sql_iso(sql_list(map(quote_value, evict[i : i + TOUCH_BATCH]))),
+                    )
+                )
+        with self.lock:
+            self.evictions += len(evict)
+            self.size = size
+        DEBUG and Log.note(
+            "evicted {{num}} cache entries, {{size}} bytes left",
+            num=len(evict),
+            size=size,
+        )
@@ -22,17 +22,44 @@ from mozci.push import make_push_objects
 import jx_sqlite
 import mo_math
 from jx_bigquery import bigquery
+from jx_sqlite.sqlite import quote_column, quote_value
 from jx_python import jx
-from mo_dots import Data, coalesce, listwrap, wrap
-from mo_logs import startup, constants, Log, machine_metadata
-from mo_threads import Process
-from mo_times import Date, Duration, Timer
+from mo_dots import Data, coalesce, listwrap, unwrap, wrap
+from mo_etl.cache import DEFAULT_FILENAME, CacheStore, settled
+from mo_future import text
+from mo_logs import startup, constants, Log, machine_metadata, Except
+from mo_logs.exceptions import suppress_exception
+from mo_sql import ConcatSQL, SQL_AND, SQL_EQ, SQL_FROM, SQL_SELECT, SQL_WHERE, sql_list
+from mo_threads import Lock, Process, Queue, Signal, Thread, THREAD_STOP, Till
+from mo_times import Date, Duration, Timer, MINUTE
 from pyLibrary.env import git
 
+try:
+    from importlib.metadata import PackageNotFoundError, version as package_version
+except ImportError:
+    from pkg_resources import DistributionNotFound as PackageNotFoundError, get_distribution
+
+    def package_version(package):
+        return get_distribution(package).version
+
 DEFAULT_START = "today-2day"
+DEFAULT_THREADS = 4  # NUMBER OF PUSHES TO PROCESS AT ONCE
+DEFAULT_BATCH_SIZE = 100  # NUMBER OF RECORDS TO SEND TO BIGQUERY AT ONCE
+DEFAULT_CHUNK_THREADS = 2  # NUMBER OF (start, end, branch) CHUNKS TO PROCESS AT ONCE
+DEFAULT_MAX_ATTEMPTS = 3  # STOP RETRYING A CHUNK AFTER THIS MANY FAILURES, UNTIL THE NEXT RUN
+DEFAULT_CACHE_SETTLE = "week"  # PUSHES OLDER THAN THIS WILL NOT CHANGE, SO THEIR CACHE ENTRIES DO NOT EXPIRE
+RETRY_BACKOFF = MINUTE  # WAIT BEFORE FIRST RETRY, DOUBLED FOR EACH ATTEMPT
+FORWARD, RETRY, BACKFILL = 0, 1, 2  # CHUNK PRIORITY, LOWER IS FIRST
+PACKAGES = ["mozci", "adr", "google-cloud-bigquery"]  # VERSIONS RECORDED WITH EVERY PUSH
+PUSHES_TABLE = "etl_pushes"
+CHUNKS_TABLE = "etl_chunks"
+CHUNK_COLUMNS = ["start", "end", "branch", "mozci_version", "state", "attempts", "duration", "rows"]
 LOOK_BACK = 30
 LOOK_FORWARD = 30
 
+_cache_stores = {}  # MAP FROM ABSOLUTE FILENAME TO ITS ONE CacheStore
+_cache_stores_lock = Lock("cache stores")
+
 
 class Schedulers:
     def __init__(self, config):
@@ -42,15 +69,45 @@ class Schedulers:
         config.start = Date(config.start)
         config.interval = Duration(config.interval)
         config.branches = listwrap(config.branches)
+        config.threads = coalesce(config.threads, DEFAULT_THREADS)
+        config.batch_size = coalesce(config.batch_size, DEFAULT_BATCH_SIZE)
+        config.chunk_threads = coalesce(config.chunk_threads, DEFAULT_CHUNK_THREADS)
+        config.max_attempts = coalesce(config.max_attempts, DEFAULT_MAX_ATTEMPTS)
+        config.cache_settle = Duration(coalesce(config.cache_settle, DEFAULT_CACHE_SETTLE))
         self.destination = bigquery.Dataset(config.destination).get_or_create_table(
             config.destination
         )
 
+        # RUN METADATA, SHARED BY ALL RECORDS
+        self.etl = {
+            "revision": git.get_revision(),
+            "versions": {p: self.version(p) for p in PACKAGES},
+            "machine": unwrap(machine_metadata),
+        }
+
         # CALCULATE THE PREVIOUS RUN
-        mozci_version = self.version("mozci")
-        self.etl_config_table = jx_sqlite.Container(
-            config.config_db
-        ).get_or_create_facts("etl-range")
+        # NEVER NULL, IT IS USED AS A KEY IN THE SQL TABLES BELOW
+        mozci_version = coalesce(self.etl["versions"]["mozci"], "unknown")
+        config_db = jx_sqlite.Container(config.config_db)
+        self.etl_config_table = config_db.get_or_create_facts("etl-range")
+        # PUSHES ALREADY SENT TO BIGQUERY, SO A RESTART DOES NOT REPEAT THEM
+        self.db = config_db.db
+        with self.db.transaction() as t:
+            t.execute(
+                "CREATE TABLE IF NOT EXISTS "
+                + PUSHES_TABLE
+                + " (push INTEGER, branch TEXT, mozci_version TEXT, PRIMARY KEY (push, branch, mozci_version))"
+            )
+            # ONE ROW PER (start, end, branch) CHUNK, WITH ITS STATE
+            t.execute(
+                "CREATE TABLE IF NOT EXISTS "
+                + CHUNKS_TABLE
+                + ' (start REAL, "end" REAL, branch TEXT, mozci_version TEXT, state TEXT,'
+                + ' attempts INTEGER, duration REAL, "rows" INTEGER, PRIMARY KEY (start, branch, mozci_version))'
+            )
+        self.done_lock = Lock("update etl-range")
+        # bigquery.Table.extend() IS NOT THREAD SAFE, CHUNK WORKERS TAKE TURNS
+        self.destination_lock = Lock("send to bigquery")
         done_result = wrap(self.etl_config_table.query()).data
         prev_done = done_result[0]
         if len(done_result) and prev_done.mozci_version == mozci_version:
@@ -68,6 +125,13 @@ class Schedulers:
             self.etl_config_table.add(self.done)
 
     def version(self, package):
+        try:
+            return package_version(package)
+        except PackageNotFoundError:
+            return None
+        except Exception:
+            pass
+
         with Process("", ["pip", "show", package]) as p:
             for line in p.stdout:
                 if line.lower().startswith("version: "):
@@ -75,18 +139,18 @@ class Schedulers:
             return None
 
     def process_one(self, start, end, branch):
-        # ASSUME PREVIOUS WORK IS DONE
-        # UPDATE THE DATABASE STATE
-        self.done.min = mo_math.min(end, self.done.min)
-        self.done.max = mo_math.max(start, self.done.max)
-        self.etl_config_table.update({"set": self.done})
-
+        """
+        :return: NUMBER OF RECORDS SENT TO BIGQUERY
+        """
+        # OLD PUSHES ARE CACHED UNTIL EVICTED, RECENT ONES ONLY FOR THE adr retention
+        is_settled = end < Date.now() - self.config.cache_settle
         try:
-            pushes = make_push_objects(
-                from_date=start.format(), to_date=end.format(), branch=branch
-            )
+            with settled(is_settled):
+                pushes = make_push_objects(
+                    from_date=start.format(), to_date=end.format(), branch=branch
+                )
         except MissingDataError:
-            return
+            return 0
         except Exception as e:
             raise Log.error("not expected", cause=e)
 
@@ -98,67 +162,224 @@ class Schedulers:
             branch=branch,
         )
 
+        done = self.pushes_done(branch)
+        todo = [push for push in pushes if push.id not in done]
+        if len(todo) < len(pushes):
+            Log.note(
+                "Skipping {{num}} pushes already done", num=len(pushes) - len(todo)
+            )
+        if not todo:
+            return 0
+
+        # FAN OUT TO WORKERS, RESULTS ARE TAGGED WITH THEIR INDEX SO WE CAN RESTORE PUSH ORDER
+        please_stop = Signal("stop processing pushes")
+        work = Queue("pushes to process", max=len(todo) + 1, silent=True)
+        results = Queue("processed pushes", max=len(todo) + 1, silent=True)
+        work.extend(enumerate(todo))
+        work.add(THREAD_STOP)
+        workers = [
+            Thread.run(
+                "push worker " + text(i),
+                self._push_worker,
+                work,
+                results,
+                branch,
+                is_settled,
+                please_stop=please_stop,
+            )
+            for i in range(min(self.config.threads, len(todo)))
+        ]
+
         data = []
+        num_rows = 0
+        pending = {}
+        next_index = 0
         try:
-            for push in pushes:
-                with Timer("get tasks for push {{push}}", {"push": push.id}):
-                    schedulers = [
-                        label.split("shadow-scheduler-")[1]
-                        for label in push.scheduled_task_labels
-                        if "shadow-scheduler" in label
-                    ]
-                    scheduler = []
-                    for s in schedulers:
-                        try:
-                            scheduler.append({"name": s, "tasks": jx.sort(push.get_shadow_scheduler_tasks(s))})
-                        except Exception:
-                            pass
+            while next_index < len(todo):
+                index, record = results.pop()
+                pending[index] = record
+                while next_index in pending:
+                    record = pending.pop(next_index)
+                    if isinstance(record, Except):
+                        Log.error(
+                            "Could not process push {{push}}",
+                            push=todo[next_index].id,
+                            cause=record,
+                        )
+                    next_index += 1
+                    data.append(record)
+                    if len(data) >= self.config.batch_size:
+                        # FORGET THE BATCH BEFORE SENDING, SO A FAILED flush() IS NOT REPEATED BELOW
+                        batch, data = data, []
+                        self.flush(batch, branch)
+                        num_rows += len(batch)
+        except Exception as e:
+            please_stop.go()
+            for w in workers:
+                with suppress_exception:
+                    w.join()
+            # ADD WHATEVER WE HAVE, BUT DO NOT LOSE THE ORIGINAL PROBLEM
+            try:
+                self.flush(data, branch)
+            except Exception as f:
+                Log.warning(
+                    "Could not add {{num}} records for {{branch}}",
+                    num=len(data),
+                    branch=branch,
+                    cause=f,
+                )
+            raise e
+
+        for w in workers:
+            w.join()
+        self.flush(data, branch)
+        num_rows += len(data)
+        return num_rows
+
+    def _push_worker(self, work, results, branch, is_settled, please_stop):
+        with settled(is_settled):
+            while not please_stop:
+                item = work.pop(till=please_stop)
+                if item is THREAD_STOP or item is None:
+                    break
+                index, push = item
                 try:
-                    regressions = push.get_regressions("label").keys()
+                    results.add((index, self.push_record(push, branch)))
                 except Exception as e:
-                    regressions = []
-                    Log.warning(
-                        "could not get regressions for {{push}}", push=push.id, cause=e
-                    )
+                    results.add((index, Except.wrap(e)))
+
+    def push_record(self, push, branch):
+        with Timer("get tasks for push {{push}}", {"push": push.id}):
+            schedulers = [
+                label.split("shadow-scheduler-")[1]
+                for label in push.scheduled_task_labels
+                if "shadow-scheduler" in label
+            ]
+            scheduler = []
+            for s in schedulers:
+                try:
+                    scheduler.append({"name": s, "tasks": jx.sort(push.get_shadow_scheduler_tasks(s))})
+                except Exception:
+                    pass
+        try:
+            regressions = push.get_regressions("label").keys()
+        except Exception as e:
+            regressions = []
+            Log.warning(
+                "could not get regressions for {{push}}", push=push.id, cause=e
+            )
 
-                # RECORD THE PUSH
-                data.append(
-                    {
-                        "push": {
-                            "id": push.id,
-                            "date": push.date,
-                            "changesets": push.revs,
-                            "backedoutby": push.backedoutby,
-                        },
-                        "schedulers": scheduler,
-                        "regressions": [
-                            {"label": name} for name in jx.sort(regressions)
-                        ],
-                        "branch": branch,
-                        "etl": {
-                            "revision": git.get_revision(),
-                            "timestamp": Date.now(),
-                        },
-                    }
-                )
-        finally:
-            # ADD WHATEVER WE HAVE
+        # RECORD THE PUSH
+        return {
+            "push": {
+                "id": push.id,
+                "date": push.date,
+                "changesets": push.revs,
+                "backedoutby": push.backedoutby,
+            },
+            "schedulers": scheduler,
+            "regressions": [
+                {"label": name} for name in jx.sort(regressions)
+            ],
+            "branch": branch,
+            "etl": dict(self.etl, timestamp=Date.now()),
+        }
+
+    def pushes_done(self, branch):
+        """
+        :return: SET OF PUSH IDS ALREADY SENT TO BIGQUERY FOR THIS branch
+        """
+        result = self.db.query(
+            ConcatSQL(
+                SQL_SELECT,
+                quote_column("push"),
+                SQL_FROM,
+                quote_column(PUSHES_TABLE),
+                SQL_WHERE,
+                quote_column("branch"),
+                SQL_EQ,
+                quote_value(branch),
+                SQL_AND,
+                quote_column("mozci_version"),
+                SQL_EQ,
+                quote_value(self.done.mozci_version),
+            )
+        ).data
+        return set(push for push, in result)
+
+    def flush(self, data, branch):
+        """
+        SEND data TO BIGQUERY, THEN MARK THE PUSHES AS DONE
+        """
+        if not data:
+            return
+        with self.destination_lock:
             with Timer("adding {{num}} records to bigquery", {"num": len(data)}):
                 self.destination.extend(data)
+        with self.db.transaction() as t:
+            t.execute_many(
+                "INSERT OR REPLACE INTO "
+                + PUSHES_TABLE
+                + " (push, branch, mozci_version) VALUES (?, ?, ?)",
+                [
+                    (record["push"]["id"], branch, self.done.mozci_version)
+                    for record in data
+                ],
+            )
 
-    def process(self):
+    def todo_chunks(self):
+        """
+        :return: CHUNKS OF WORK, IN PRIORITY ORDER: FORWARD FILL, THEN RETRIES, THEN BACKFILL
+        """
         done = self.done
         config = self.config
 
-        # ADD CHUNKS OF WORK
-        self.todo = []
+        # CHUNKS FROM PREVIOUS RUNS
+        known = {}
+        previous = self.db.query(
+            ConcatSQL(
+                SQL_SELECT,
+                sql_list([quote_column(c) for c in CHUNK_COLUMNS]),
+                SQL_FROM,
+                quote_column(CHUNKS_TABLE),
+                SQL_WHERE,
+                quote_column("mozci_version"),
+                SQL_EQ,
+                quote_value(done.mozci_version),
+            )
+        ).data
+        for row in previous:
+            chunk = wrap(dict(zip(CHUNK_COLUMNS, row)))
+            known[(chunk.start, chunk.branch)] = chunk
+
+        todo = []
+        new_chunks = []
+        new_keys = set()
+
+        def add(start, end, branch, priority):
+            key = (start.unix, branch)
+            if key in known:
+                return
+            chunk = known[key] = Data(
+                start=start.unix,
+                end=end.unix,
+                branch=branch,
+                mozci_version=done.mozci_version,
+                state="pending",
+                attempts=0,
+                priority=priority,
+            )
+            new_chunks.append(chunk)
+            new_keys.add(key)
+            todo.append(chunk)
+
         if done.max < config.range.max:
             # ADD WORK GOING FORWARDS
             start = Date.floor(done.max, config.interval)
             while start < config.range.max:
                 end = start + config.interval
                 for branch in config.branches:
-                    self.todo.append((start, end, branch))
+                    add(start, end, branch, FORWARD)
                 start = end
         if config.range.min < done.min:
             # ADD WORK GOING BACKWARDS
@@ -166,16 +387,168 @@ class Schedulers:
             while config.range.min < end:
                 start = end - config.interval
                 for branch in config.branches:
-                    self.todo.append((start, end, branch))
+                    add(start, end, branch, BACKFILL)
                 end = start
+        self.save_chunks(new_chunks)
+
+        # PENDING, INTERRUPTED, OR FAILED CHUNKS FROM PREVIOUS RUNS
+        # done.min/max MAY ALREADY COVER THEM, SO THIS IS THE ONLY WAY THEIR PUSHES GET DONE
+        for chunk in known.values():
+            if (chunk.start, chunk.branch) in new_keys or chunk.state == "done":
+                continue
+            if not (config.range.min.unix <= chunk.start < config.range.max.unix):
+                continue
+            chunk.priority = RETRY
+            chunk.attempts = 0  # max_attempts IS PER RUN
+            todo.append(chunk)
+
+        # sorted() IS STABLE, SO EACH PRIORITY KEEPS ITS OWN ORDER
+        return sorted(todo, key=lambda c: c.priority)
+
+    def process(self):
+        self.todo = self.todo_chunks()
+        if not self.todo:
+            Log.note("No work to do")
+            return
+
+        please_stop = Signal("stop processing chunks")
+        work = Queue("chunks to process", max=len(self.todo) + 1, silent=True)
+        work.extend(self.todo)
+        work.add(THREAD_STOP)
+        workers = [
+            Thread.run(
+                "chunk worker " + text(i),
+                self._chunk_worker,
+                work,
+                please_stop=please_stop,
+            )
+            for i in range(min(self.config.chunk_threads, len(self.todo)))
+        ]
 
+        failures = 0
         try:
-            for start, end, branch in self.todo:
-                self.process_one(start, end, branch)
+            for w in workers:
+                failures += w.join()
         except Exception as e:
+            please_stop.go()
             Log.warning("Could not complete the etl", cause=e)
+            # THE OTHER WORKERS MAY STILL BE USING THE CACHE, WAIT FOR THEM
+            for w in workers:
+                with suppress_exception:
+                    w.join()
+            return
+        finally:
+            # CLOSES THE CACHE, SO ONLY AFTER ALL WORKERS ARE DONE
+            self.cache_stats()
+
+        if failures:
+            Log.warning("Could not complete {{num}} chunks of the etl", num=failures)
         else:
-            self.destination.merge_shards()
+            # REMEMBER THE SCHEMA OF EACH BIGQUERY SHARD, SO merge_shards() ONLY ASKS ABOUT NEW ONES
+            self.destination.merge_shards(schema_cache=self.db)
+
+    def cache_stats(self):
+        with _cache_stores_lock:
+            stores = list(_cache_stores.values())
+            _cache_stores.clear()
+        for store in stores:
+            Log.note(
+                "adr cache: {{hits}} hits, {{misses}} misses, {{puts}} puts, {{evictions}} evictions, {{size}} bytes",
+                **store.stats
+            )
+            store.close()
+
+    def _chunk_worker(self, work, please_stop):
+        """
+        :return: NUMBER OF CHUNKS THAT FAILED
+        """
+        failures = 0
+        while not please_stop:
+            chunk = work.pop(till=please_stop)
+            if chunk is THREAD_STOP or chunk is None:
+                break
+            if not self.process_chunk(chunk, please_stop):
+                failures += 1
+        return failures
+
+    def process_chunk(self, chunk, please_stop):
+        """
+        PROCESS ONE CHUNK, RETRYING WITH BACKOFF
+        :return: True IF SUCCESSFUL
+        """
+        start, end, branch = Date(chunk.start), Date(chunk.end), chunk.branch
+        while not please_stop:
+            chunk.attempts += 1
+            chunk.state = "running"
+            self.save_chunk(chunk)
+            timer = Timer(
+                "process {{branch}} ({{start}}, {{end}})",
+                {"branch": branch, "start": start, "end": end},
+            )
+            try:
+                with timer:
+                    chunk.rows = self.process_one(start, end, branch)
+            except Exception as e:
+                chunk.state = "failed"
+                chunk.duration = timer.duration.seconds
+                self.save_chunk(chunk)
+                if chunk.attempts >= self.config.max_attempts:
+                    Log.warning(
+                        "Giving up on {{branch}} ({{start}}, {{end}}) after {{attempts}} attempts, will retry next run",
+                        branch=branch,
+                        start=start,
+                        end=end,
+                        attempts=chunk.attempts,
+                        cause=e,
+                    )
+                    return False
+                backoff = RETRY_BACKOFF.seconds * 2 ** (chunk.attempts - 1)
+                Log.warning(
+                    "Problem with {{branch}} ({{start}}, {{end}}), retry in {{backoff}} seconds",
+                    branch=branch,
+                    start=start,
+                    end=end,
+                    backoff=backoff,
+                    cause=e,
+                )
+                (Till(seconds=backoff) | please_stop).wait()
+                continue
+
+            chunk.state = "done"
+            chunk.duration = timer.duration.seconds
+            self.save_chunk(chunk)
+
+            # UPDATE THE DATABASE STATE
+            with self.done_lock:
+                self.done.min = mo_math.min(start, self.done.min)
+                self.done.max = mo_math.max(end, self.done.max)
+                self.etl_config_table.update({"set": self.done})
+            return True
+        return False
+
+    def save_chunk(self, chunk):
+        self.save_chunks([chunk])
+
+    def save_chunks(self, chunks):
+        """
+        WRITE THE FULL STATE OF EACH CHUNK, REPLACING ANY PREVIOUS ROW
+        """
+        if not chunks:
+            return
+        with self.db.transaction() as t:
+            t.execute_many(
+                "INSERT OR REPLACE INTO "
+                + CHUNKS_TABLE
+                + " ("
+                + ", ".join('"' + c + '"' for c in CHUNK_COLUMNS)
+                + ") VALUES ("
+                + ", ".join("?" for _ in CHUNK_COLUMNS)
+                + ")",
+                [
+                    tuple(unwrap(chunk[c]) for c in CHUNK_COLUMNS)
+                    for chunk in chunks
+                ],
+            )
 
 
 def main():
@@ -198,11 +571,12 @@ def main():
                     map(os.path.expanduser, set(self._config["sources"]))
                 )
 
-                # Use the NullStore by default. This allows us to control whether
-                # caching is enabled or not at runtime.
-                self._config["cache"].setdefault("stores", {"null": {"driver": "null"}})
+                # Use the local sqlite store by default. The "null" driver is still
+                # available, so caching can be disabled at runtime.
+                self._config["cache"].setdefault("stores", {"etl": {"driver": "etl"}})
                 object.__setattr__(self, "cache", CacheManager(self._config["cache"]))
                 self.cache.extend("null", lambda driver: NullStore())
+                self.cache.extend("etl", _cache_store)
 
             setattr(Configuration, "update", update)
 
@@ -225,6 +599,19 @@ def main():
         Log.stop()
 
 
+def _cache_store(config):
+    """
+    cachy CALLS THE STORE CREATOR ON EVERY get()/put(), SO HAND BACK THE SAME
+    CacheStore FOR THE SAME FILE INSTEAD OF OPENING ANOTHER ONE
+    """
+    filename = os.path.abspath(coalesce(config.get("filename"), DEFAULT_FILENAME))
+    with _cache_stores_lock:
+        store = _cache_stores.get(filename)
+        if store is None:
+            store = _cache_stores[filename] = CacheStore(kwargs=config)
+        return store
+
+
 def _logging(message):
     # params = wrap(message.record)
     # Log.note(message, default_params=params)
@@ -0,0 +1,55 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+ColumnContainer AGGREGATES FOLLOW mo_math: null FOR NO VALUES, NaN IS IGNORED
+
+    PYTHONPATH=.:vendor python -m unittest discover tests
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from jx_python import jx
+from jx_python.containers.list_usingColumns import ColumnContainer
+from mo_dots import unwrap
+
+NAN = float("nan")
+DATA = [
+    {"a": 1, "b": "x"},
+    {"a": NAN, "b": "x"},
+    {"a": 3, "b": "x"},
+    {"a": None, "b": "null"},
+    {"b": "missing"},
+    {"a": NAN, "b": "nan"},
+]
+
+
+def aggregate(name):
+    result = jx.run({
+        "from": ColumnContainer("test", DATA),
+        "select": {"value": "a", "aggregate": name},
+        "groupby": "b",
+        "format": "list",
+    })
+    return {row["b"]: row.get("a") for row in unwrap(result.data)}
+
+
+class TestAggregates(unittest.TestCase):
+    def test_sum(self):
+        self.assertEqual(aggregate("sum"), {"x": 4, "null": None, "missing": None, "nan": None})
+
+    def test_average(self):
+        self.assertEqual(aggregate("average"), {"x": 2, "null": None, "missing": None, "nan": None})
+
+    def test_count(self):
+        self.assertEqual(aggregate("count"), {"x": 3, "null": 0, "missing": 0, "nan": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
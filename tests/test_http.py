@@ -0,0 +1,158 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+SHARED SESSIONS AND fetch_many() AGAINST A LOCAL HTTP SERVER
+
+    PYTHONPATH=.:vendor python -m unittest discover tests
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import json
+import socket
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+
+from mo_http import http
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    /status/<code> RESPONDS WITH THAT STATUS, /slow WAITS A BIT, ANYTHING
+    ELSE IS A SMALL JSON DOCUMENT
+    """
+
+    protocol_version = "HTTP/1.1"  # KEEP CONNECTIONS ALIVE
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        server = self.server
+        with server.lock:
+            server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if self.path.startswith("/slow"):
+                sleep(0.05)
+            code = int(self.path[8:]) if self.path.startswith("/status/") else 200
+            body = json.dumps({"path": self.path}).encode("utf8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.url = "http://127.0.0.1:%d" % self.server_address[1]
+
+
+def unused_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class TestHttp(unittest.TestCase):
+    def setUp(self):
+        self.default_headers, http.default_headers = http.default_headers, {"Referer": "test"}
+        self.server = Server()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        http.close_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+        http.default_headers = self.default_headers
+
+    def test_connection_reuse(self):
+        for i in range(20):
+            self.assertEqual(http.get_json(self.server.url + "/doc/" + str(i)), {"path": "/doc/" + str(i)})
+        self.assertEqual(self.server.requests, 20)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_concurrency(self):
+        urls = [self.server.url + "/slow/" + str(i) for i in range(40)]
+        results = list(http.fetch_many(urls, concurrency=4))
+        self.assertEqual(sorted(r.index for r in results), list(range(40)))
+        for r in results:
+            self.assertEqual(r.response.status_code, 200)
+            self.assertEqual(json.loads(r.response.all_content.decode("utf8"))["path"], "/slow/" + str(r.index))
+        self.assertGreater(self.server.max_active, 1)
+        self.assertLessEqual(self.server.max_active, 4)
+
+    def test_rate(self):
+        urls = [self.server.url + "/doc/" + str(i) for i in range(11)]
+        start = time()
+        results = list(http.fetch_many(urls, concurrency=5, rate=20))
+        self.assertGreaterEqual(time() - start, 0.45)
+        self.assertEqual(len(results), 11)
+        self.assertTrue(all(r.response.status_code == 200 for r in results))
+
+    def test_errors(self):
+        refused = "http://127.0.0.1:%d/doc" % unused_port()
+        urls = [
+            self.server.url + "/status/500",
+            refused,
+            {"method": "get"},  # NO url
+            "not a url",
+            [refused, self.server.url + "/doc/list"],  # TRY EACH, IN TURN
+            self.server.url + "/doc/ok",
+        ]
+        fetch = http.fetch_many(urls, concurrency=3, rate=100)
+        results = {}
+
+        def consume():
+            for r in fetch:
+                results[r.index] = r
+
+        # A WORKER THAT DIES WITHOUT A RESULT LEAVES fetch WAITING FOREVER
+        consumer = threading.Thread(target=consume)
+        consumer.daemon = True
+        consumer.start()
+        consumer.join(timeout=30)
+        self.assertFalse(consumer.is_alive(), "fetch_many() is stuck")
+        self.assertEqual(sorted(results), list(range(len(urls))))
+        self.assertEqual(results[0].response.status_code, 500)
+        for i in [1, 2, 3]:
+            self.assertFalse(results[i].response, "result " + str(i))
+            self.assertIsNotNone(results[i].error, "result " + str(i))
+        self.assertEqual(results[4].response.status_code, 200)
+        self.assertEqual(results[5].response.status_code, 200)
+        self.assertEqual(fetch.latency.errors, 3)
+        self.assertEqual(fetch.latency.count, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
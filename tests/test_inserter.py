@@ -0,0 +1,140 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+Inserter AGAINST A LOCAL STAND-IN FOR bigquery.Client.insert_rows_json()
+
+    PYTHONPATH=.:vendor python -m unittest discover tests
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import json
+import threading
+import unittest
+
+from jx_bigquery import inserter
+from jx_bigquery.inserter import Inserter
+from mo_json import value2json
+
+TABLE = "project.dataset.table"
+
+
+class HttpError(Exception):
+    """
+    LIKE google.api_core.exceptions, WITH THE HTTP STATUS IN code
+    """
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+class FakeClient(object):
+    """
+    ACCEPT ROWS LIKE insert_rows_json(), BUT REJECT PAYLOADS OVER max_bytes,
+    REPORT ROW ERRORS FOR ROWS WITH "bad", AND RAISE THE QUEUED errors FIRST
+    """
+
+    def __init__(self, max_bytes=None, errors=()):
+        self.max_bytes = max_bytes
+        self.errors = list(errors)
+        self.lock = threading.Lock()
+        self.requests = []  # (rows, row_ids) OF EVERY CALL
+        self.accepted = {}  # MAP FROM insertId TO ROW, SO A RESEND IS NOT A DUPLICATE
+
+    def insert_rows_json(self, table, json_rows, row_ids, skip_invalid_rows, ignore_unknown_values):
+        with self.lock:
+            self.requests.append((list(json_rows), list(row_ids)))
+            if self.errors:
+                raise self.errors.pop(0)
+        if self.max_bytes and len(json.dumps(json_rows)) > self.max_bytes:
+            raise HttpError(413, "Request payload size exceeds the limit: 10485760 bytes.")
+
+        failures = []
+        with self.lock:
+            for i, (row, row_id) in enumerate(zip(json_rows, row_ids)):
+                if row.get("bad"):
+                    failures.append({"index": i, "errors": [{"reason": "invalid"}]})
+                else:
+                    self.accepted[row_id] = row
+        return failures
+
+
+def make_rows(num, bad=()):
+    return [{"id": i, "text": "x" * 100, "bad": i in bad} for i in range(num)]
+
+
+class TestInserter(unittest.TestCase):
+    def setUp(self):
+        self.retry_wait, inserter.RETRY_WAIT = inserter.RETRY_WAIT, 0
+
+    def tearDown(self):
+        inserter.RETRY_WAIT = self.retry_wait
+
+    def test_cut_by_rows(self):
+        client = FakeClient()
+        failures = Inserter(client=client, max_rows=3, threads=1).insert(TABLE, make_rows(10))
+        self.assertEqual(failures, [])
+        self.assertEqual([len(rows) for rows, _ in client.requests], [3, 3, 3, 1])
+        self.assertEqual(sorted(r["id"] for r in client.accepted.values()), list(range(10)))
+
+    def test_cut_by_bytes(self):
+        client = FakeClient()
+        rows = make_rows(20)
+        max_bytes = 5 * len(value2json(rows[0]))
+        Inserter(client=client, max_bytes=max_bytes, threads=1).insert(TABLE, rows)
+        self.assertGreater(len(client.requests), 1)
+        for sent, _ in client.requests:
+            self.assertLessEqual(sum(len(value2json(r)) + 1 for r in sent), max_bytes)
+        self.assertEqual([r["id"] for sent, _ in client.requests for r in sent], list(range(20)))
+
+    def test_split_too_big(self):
+        rows = make_rows(16)
+        client = FakeClient(max_bytes=3 * len(json.dumps(rows[0])))
+        failures = Inserter(client=client, threads=1).insert(TABLE, rows)
+        self.assertEqual(failures, [])
+        self.assertEqual(len(client.requests[0][0]), 16)
+        self.assertEqual(sorted(r["id"] for r in client.accepted.values()), list(range(16)))
+
+    def test_failure_index(self):
+        bad = {0, 4, 7, 13, 15}
+        rows = make_rows(16, bad)
+        for threads in [1, 4]:
+            client = FakeClient(max_bytes=3 * len(json.dumps(rows[0])))
+            failures = Inserter(client=client, max_rows=5, threads=threads).insert(TABLE, rows)
+            self.assertEqual([f["index"] for f in failures], sorted(bad))
+            self.assertEqual(
+                sorted(r["id"] for r in client.accepted.values()),
+                [i for i in range(16) if i not in bad],
+            )
+
+    def test_retry_transient(self):
+        client = FakeClient(errors=[HttpError(503, "Service Unavailable"), IOError("connection reset")])
+        failures = Inserter(client=client, threads=1).insert(TABLE, make_rows(4))
+        self.assertEqual(failures, [])
+        self.assertEqual(len(client.requests), 3)
+        # THE SAME insertIds ARE SENT EVERY TIME
+        self.assertEqual(len(set(tuple(ids) for _, ids in client.requests)), 1)
+        self.assertEqual(len(set(client.requests[0][1])), 4)
+        self.assertEqual(len(client.accepted), 4)
+
+    def test_no_retry_permanent(self):
+        client = FakeClient(errors=[HttpError(404, "Not found: Table")])
+        with self.assertRaises(Exception):
+            Inserter(client=client, threads=1).insert(TABLE, make_rows(4))
+        self.assertEqual(len(client.requests), 1)
+
+    def test_give_up(self):
+        client = FakeClient(errors=[HttpError(503, "Service Unavailable")] * 10)
+        with self.assertRaises(Exception):
+            Inserter(client=client, threads=1, retries=2).insert(TABLE, make_rows(4))
+        self.assertEqual(len(client.requests), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
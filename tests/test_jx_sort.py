@@ -0,0 +1,181 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+jx.sort() AND groupby(ordered=False) MUST AGREE WITH value_compare()
+
+    PYTHONPATH=.:vendor python -m unittest discover tests
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import random
+import unittest
+from decimal import Decimal
+
+from jx_base.language import value_compare
+from jx_python import jx
+from jx_python.group_by import groupby
+from mo_dots import Null
+from mo_future import sort_using_cmp
+from mo_times import Date
+
+NAN = float("nan")
+VALUES = [
+    None,
+    Null,
+    NAN,
+    float("nan"),
+    True,
+    False,
+    0,
+    1,
+    -3,
+    1.0,
+    2.5,
+    -0.5,
+    Decimal("1.5"),
+    Date("2020-01-01"),
+    Date("1970-01-01T00:00:02"),
+    "",
+    "a",
+    "B",
+    "abc",
+]
+HASHABLE = [v for v in VALUES if v is not NAN and not (v.__class__ is float and v != v)]
+DIRECTIONS = [
+    [("a", 1)],
+    [("a", -1)],
+    [("a", 1), ("b", 1)],
+    [("a", -1), ("b", -1)],
+    [("a", 1), ("b", -1)],
+    [("a", -1), ("b", 1)],
+]
+
+
+def make_rows(values, num, seed):
+    r = random.Random(seed)
+    return [{"a": r.choice(values), "b": r.choice(values), "i": i} for i in range(num)]
+
+
+def compare_sort(rows, fields):
+    """
+    jx.sort() AS IT WAS, WITH value_compare() ON EVERY PAIR
+    """
+
+    def comparer(left, right):
+        for field, sort_ in fields:
+            result = value_compare(left[field], right[field], sort_)
+            if result != 0:
+                return result
+        return 0
+
+    return sort_using_cmp(rows, cmp=comparer)
+
+
+class TestSort(unittest.TestCase):
+    def test_values(self):
+        for seed in range(20):
+            values = [row["a"] for row in make_rows(VALUES, 200, seed)]
+            expected = sort_using_cmp(values, value_compare)
+            result = list(jx.sort(values))
+            self.assertEqual(
+                [id(v) if v.__class__ is float and v != v else v for v in expected],
+                [id(v) if v.__class__ is float and v != v else v for v in result],
+            )
+
+    def test_one_type(self):
+        for values in [[3, 1, 2, 1], ["b", "a", "c"], [2.5, -1.0, 0.0], [Date("2020-01-02"), Date("2020-01-01")]]:
+            rows = [{"a": v, "b": None, "i": i} for i, v in enumerate(values)]
+            for fields in DIRECTIONS:
+                self.assertEqual(
+                    [row["i"] for row in compare_sort(rows, fields)],
+                    [row["i"] for row in jx.sort(rows, [{"value": f, "sort": s} for f, s in fields])],
+                    "sort by " + repr(fields),
+                )
+
+    def test_mixed_types(self):
+        for seed in range(20):
+            rows = make_rows(VALUES, 300, seed)
+            for fields in DIRECTIONS:
+                self.assertEqual(
+                    [row["i"] for row in compare_sort(rows, fields)],
+                    [row["i"] for row in jx.sort(rows, [{"value": f, "sort": s} for f, s in fields])],
+                    "sort by " + repr(fields) + " with seed " + repr(seed),
+                )
+
+    def test_nulls_last(self):
+        rows = [{"a": v, "i": i} for i, v in enumerate([None, 2, NAN, 1, Null])]
+        self.assertEqual([r["i"] for r in jx.sort(rows, "a")], [3, 1, 0, 2, 4])
+        self.assertEqual([r["i"] for r in jx.sort(rows, {"a": "desc"})], [1, 3, 0, 2, 4])
+
+    def test_fallback_for_lists(self):
+        rows = [{"a": [2, 1], "i": 0}, {"a": 3, "i": 1}, {"a": [1], "i": 2}, {"a": None, "i": 3}]
+        for fields in DIRECTIONS[:2]:
+            self.assertEqual(
+                [row["i"] for row in compare_sort(rows, fields)],
+                [row["i"] for row in jx.sort(rows, [{"value": f, "sort": s} for f, s in fields])],
+            )
+
+
+class TestGroupBy(unittest.TestCase):
+    def test_same_groups(self):
+        for seed in range(20):
+            rows = make_rows(HASHABLE, 300, seed)
+            for keys in [["a"], ["a", "b"]]:
+                self.assertEqual(
+                    compare_groups(rows, keys),
+                    _groups(groupby(rows, keys, ordered=False)),
+                    "groupby " + repr(keys) + " with seed " + repr(seed),
+                )
+
+    def test_first_appearance(self):
+        rows = [{"a": v, "i": i} for i, v in enumerate(["b", "a", None, "b", 1, True, 1.0, Null])]
+        result = [(g.a, [r["i"] for r in rows_]) for g, rows_ in groupby(rows, "a", ordered=False)]
+        self.assertEqual(result, [("b", [0, 3]), ("a", [1]), (None, [2, 7]), (1, [4, 6]), (True, [5])])
+
+    def test_values(self):
+        values = [r["a"] for r in make_rows(HASHABLE, 300, 0)]
+        rows = [{"a": v, "i": i} for i, v in enumerate(values)]
+        self.assertEqual(
+            sorted(len(g) for g in compare_groups(rows, ["a"])),
+            sorted(len(g) for _, g in groupby(values, ordered=False)),
+        )
+
+    def test_unhashable_keys(self):
+        rows = [{"a": [1, 2], "i": 0}, {"a": 3, "i": 1}, {"a": [1, 2], "i": 2}]
+        self.assertEqual(
+            _groups(groupby(rows, "a")),
+            _groups(groupby(rows, "a", ordered=False)),
+        )
+
+
+def compare_groups(rows, keys):
+    """
+    ROWS ARE IN THE SAME GROUP WHEN value_compare() SAYS EVERY KEY IS EQUAL
+    :return: SET OF GROUPS, EACH A frozenset OF ROW INDEXES
+    """
+    groups = []
+    for row in rows:
+        for first, members in groups:
+            if all(value_compare(first[k], row[k]) == 0 for k in keys):
+                members.append(row["i"])
+                break
+        else:
+            groups.append((row, [row["i"]]))
+    return set(frozenset(members) for _, members in groups)
+
+
+def _groups(result):
+    """
+    :return: SET OF GROUPS, EACH A frozenset OF ROW INDEXES
+    """
+    return set(frozenset(row["i"] for row in rows) for _, rows in result)
+
+
+if __name__ == "__main__":
+    unittest.main()